@@ -0,0 +1,117 @@
+import os
+import json
+import random
+import argparse
+
+# Code point ranges to draw letters from for each script
+SCRIPT_LETTERS = {
+    'latin': [(0x0061, 0x007A), (0x00E0, 0x00FF)],
+    'greek': [(0x03B1, 0x03C9)],
+    'cyrillic': [(0x0430, 0x044F)],
+    'arabic': [(0x0621, 0x064A)],
+    'devanagari': [(0x0905, 0x0939)],
+    'cjk': [(0x4E00, 0x9FFF)],
+    'hiragana': [(0x3041, 0x3096)],
+    'emoji': [(0x1F600, 0x1F64F)],
+}
+
+# Function to parse a script mix such as "latin=0.7,cjk=0.2,emoji=0.1"
+def parse_script_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name not in SCRIPT_LETTERS:
+            raise ValueError(f"Unknown script {name!r}, expected one of {', '.join(SCRIPT_LETTERS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+# Function to build a vocabulary of random words in the given script mix
+def build_vocabulary(rng, vocab_size, script_mix):
+    scripts = list(script_mix)
+    weights = [script_mix[script] for script in scripts]
+    vocabulary = set()
+    while len(vocabulary) < vocab_size:
+        ranges = SCRIPT_LETTERS[rng.choices(scripts, weights)[0]]
+        length = rng.randint(1, 6) if ranges[0][0] >= 0x3000 else rng.randint(2, 12)
+        word = ''.join(chr(rng.randint(*rng.choice(ranges))) for _ in range(length))
+        vocabulary.add(word)
+    return sorted(vocabulary)
+
+# Function to write a synthetic corpus in the chunky/chunk_*/ layout
+def generate_corpus(root, size_mb=20, vocab_size=50000, script_mix=None, underscore_density=0.2,
+                    known_fraction=0.5, file_size=1 << 20, files_per_folder=50, seed=0):
+    rng = random.Random(seed)
+    script_mix = script_mix or {'latin': 1.0}
+    vocabulary = build_vocabulary(rng, vocab_size, script_mix)
+
+    # Zipf-like word frequencies, as in natural text
+    cumulative = []
+    total = 0.0
+    for rank in range(1, len(vocabulary) + 1):
+        total += 1.0 / rank
+        cumulative.append(total)
+
+    input_folder = os.path.join(root, 'chunky')
+    target_bytes = int(size_mb * (1 << 20))
+    written_bytes = 0
+    word_count = 0
+    file_count = 0
+
+    while written_bytes < target_bytes:
+        folder = os.path.join(input_folder, f'chunk_{file_count // files_per_folder + 1}')
+        os.makedirs(folder, exist_ok=True)
+        lines = []
+        file_bytes = 0
+        while file_bytes < file_size and written_bytes + file_bytes < target_bytes:
+            words = rng.choices(vocabulary, cum_weights=cumulative, k=rng.randint(1, 15))
+            separators = rng.choices(('_', ' '), (underscore_density, 1 - underscore_density), k=len(words) - 1)
+            line = words[0] + ''.join(separator + word for separator, word in zip(separators, words[1:]))
+            lines.append(line + '\n')
+            file_bytes += len(line.encode('utf-8')) + 1
+            word_count += len(words)
+        with open(os.path.join(folder, f'chunk_{file_count:05d}'), 'w', encoding='utf-8') as f:
+            f.writelines(lines)
+        written_bytes += file_bytes
+        file_count += 1
+
+    # Start with an empty dictionary and part of the vocabulary already known
+    with open(os.path.join(root, 'chara_here.txt'), 'w', encoding='utf-8'):
+        pass
+    all_words_folder = os.path.join(root, 'all_words')
+    os.makedirs(all_words_folder, exist_ok=True)
+    known_words = rng.sample(vocabulary, int(len(vocabulary) * known_fraction))
+    with open(os.path.join(all_words_folder, 'words_1.txt'), 'w', encoding='utf-8') as f:
+        f.writelines(word + '\n' for word in known_words)
+
+    corpus = {
+        'size_mb': size_mb,
+        'vocab_size': vocab_size,
+        'script_mix': script_mix,
+        'underscore_density': underscore_density,
+        'known_fraction': known_fraction,
+        'seed': seed,
+        'files': file_count,
+        'bytes': written_bytes,
+        'words': word_count,
+    }
+    with open(os.path.join(root, 'corpus.json'), 'w', encoding='utf-8') as f:
+        json.dump(corpus, f, indent=2)
+    return corpus
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate a reproducible synthetic corpus in the chunky/ layout.")
+    parser.add_argument('root', help="directory to create the corpus in")
+    parser.add_argument('--size-mb', type=float, default=20, help="total size of the input files (default: 20)")
+    parser.add_argument('--vocab-size', type=int, default=50000, help="number of distinct words (default: 50000)")
+    parser.add_argument('--scripts', default='latin=0.7,cyrillic=0.1,cjk=0.1,arabic=0.05,emoji=0.05',
+                        help="script mix as name=weight pairs")
+    parser.add_argument('--underscore-density', type=float, default=0.2,
+                        help="share of word separators that are underscores (default: 0.2)")
+    parser.add_argument('--known-fraction', type=float, default=0.5,
+                        help="share of the vocabulary already in all_words/ (default: 0.5)")
+    parser.add_argument('--seed', type=int, default=0, help="random seed (default: 0)")
+    args = parser.parse_args()
+
+    corpus = generate_corpus(args.root, args.size_mb, args.vocab_size, parse_script_mix(args.scripts),
+                             args.underscore_density, args.known_fraction, seed=args.seed)
+    print(json.dumps(corpus, indent=2))
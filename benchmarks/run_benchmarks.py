@@ -0,0 +1,288 @@
+import os
+import sys
+import json
+import time
+import queue
+import shutil
+import platform
+import argparse
+import tempfile
+import multiprocessing
+
+# Make the scripts in the repository root importable
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from generate_corpus import generate_corpus, parse_script_mix
+from instrumentation import metrics, peak_rss_mb
+
+# Each benchmark has a prepare function, run in the harness process, that writes its inputs
+# into the work directory, and a setup function, run in the measured process, that returns the callable
+# to time, the number of input bytes, the number of items processed and the item unit
+
+def prepare_update_dictionary(corpus_root, work_dir, corpus):
+    shutil.copy(os.path.join(corpus_root, 'chara_here.txt'), os.path.join(work_dir, 'chara_here.txt'))
+
+def setup_update_dictionary(corpus_root, work_dir, corpus):
+    from extract_from_chunky import update_dictionary
+    dictionary_file = os.path.join(work_dir, 'chara_here.txt')
+    run = lambda: update_dictionary(os.path.join(corpus_root, 'chunky'), dictionary_file)
+    return run, corpus['bytes'], corpus['words'], 'words'
+
+def prepare_extract_words_and_chunk(corpus_root, work_dir, corpus):
+    os.makedirs(os.path.join(work_dir, 'output_chunks'))
+
+def setup_extract_words_and_chunk(corpus_root, work_dir, corpus):
+    from extract_from_chunky import extract_words_and_chunk
+    output_folder = os.path.join(work_dir, 'output_chunks')
+    run = lambda: extract_words_and_chunk(os.path.join(corpus_root, 'chunky'), output_folder)
+    return run, corpus['bytes'], corpus['words'], 'words'
+
+# Function to name the files of the add_new_words benchmarks inside a work directory
+def _word_paths(work_dir):
+    return (os.path.join(work_dir, 'output_chunks'), os.path.join(work_dir, 'all_words'),
+            os.path.join(work_dir, 'all_words.sqlite3'), os.path.join(work_dir, 'all_words.bloom'))
+
+# Function to extract the corpus words and copy the known vocabulary for the add_new_words benchmarks
+def prepare_word_folders(corpus_root, work_dir, corpus):
+    from extract_from_chunky import extract_words_and_chunk
+    output_folder, all_words_folder, _, _ = _word_paths(work_dir)
+    os.makedirs(output_folder)
+    extract_words_and_chunk(os.path.join(corpus_root, 'chunky'), output_folder)
+    shutil.copytree(os.path.join(corpus_root, 'all_words'), all_words_folder)
+
+# Function to also build the index, optionally behind the Bloom filter, so the benchmark finds them warm
+def _prepare_word_index(corpus_root, work_dir, corpus, bloom):
+    from sort_output_chunks import open_existing_words, close_existing_words
+    prepare_word_folders(corpus_root, work_dir, corpus)
+    _, all_words_folder, index_file, bloom_file = _word_paths(work_dir)
+    close_existing_words(open_existing_words(all_words_folder, index_file, bloom_file if bloom else None),
+                         all_words_folder)
+
+def prepare_word_index(corpus_root, work_dir, corpus):
+    _prepare_word_index(corpus_root, work_dir, corpus, bloom=False)
+
+def prepare_word_index_bloom(corpus_root, work_dir, corpus):
+    _prepare_word_index(corpus_root, work_dir, corpus, bloom=True)
+
+# Function to measure the extracted words the add_new_words benchmarks read
+def _output_bytes(output_folder):
+    return sum(os.path.getsize(os.path.join(output_folder, name)) for name in os.listdir(output_folder))
+
+def setup_add_new_words(corpus_root, work_dir, corpus):
+    from sort_output_chunks import add_new_words
+    output_folder, all_words_folder, _, _ = _word_paths(work_dir)
+    run = lambda: add_new_words(output_folder, all_words_folder)
+    return run, _output_bytes(output_folder), corpus['words'], 'words'
+
+# Function to time add_new_words against the warm index, optionally behind the warm Bloom filter
+def _setup_add_new_words_index(corpus_root, work_dir, corpus, bloom):
+    from sort_output_chunks import add_new_words
+    output_folder, all_words_folder, index_file, bloom_file = _word_paths(work_dir)
+    bloom_file = bloom_file if bloom else None
+    run = lambda: add_new_words(output_folder, all_words_folder, index_file=index_file, bloom_file=bloom_file)
+    return run, _output_bytes(output_folder), corpus['words'], 'words'
+
+def setup_add_new_words_index(corpus_root, work_dir, corpus):
+    return _setup_add_new_words_index(corpus_root, work_dir, corpus, bloom=False)
+
+def setup_add_new_words_index_bloom(corpus_root, work_dir, corpus):
+    return _setup_add_new_words_index(corpus_root, work_dir, corpus, bloom=True)
+
+def setup_add_new_words_sharded(corpus_root, work_dir, corpus):
+    from sort_output_chunks import add_new_words_sharded
+    output_folder, all_words_folder, _, _ = _word_paths(work_dir)
+    run = lambda: add_new_words_sharded(output_folder, all_words_folder, shards=os.cpu_count() or 1)
+    return run, _output_bytes(output_folder), corpus['words'], 'words'
+
+# Function to join the corpus files into one text file, so the measured process reads it in one go
+def prepare_classify(corpus_root, work_dir, corpus):
+    from extract_from_chunky import list_input_files
+    with open(os.path.join(work_dir, 'chunky.txt'), 'wb') as out:
+        for file_path in list_input_files(os.path.join(corpus_root, 'chunky')):
+            with open(file_path, 'rb') as f:
+                shutil.copyfileobj(f, out)
+
+def setup_classify(corpus_root, work_dir, corpus):
+    from ex_chara import classify
+    with open(os.path.join(work_dir, 'chunky.txt'), 'r', encoding='utf-8') as f:
+        text = f.read()
+    run = lambda: classify(text)
+    return run, corpus['bytes'], len(text), 'chars'
+
+BENCHMARKS = {
+    'update_dictionary': (prepare_update_dictionary, setup_update_dictionary),
+    'extract_words_and_chunk': (prepare_extract_words_and_chunk, setup_extract_words_and_chunk),
+    'add_new_words': (prepare_word_folders, setup_add_new_words),
+    'add_new_words_index': (prepare_word_index, setup_add_new_words_index),
+    'add_new_words_index_bloom': (prepare_word_index_bloom, setup_add_new_words_index_bloom),
+    'add_new_words_sharded': (prepare_word_folders, setup_add_new_words_sharded),
+    'classify': (prepare_classify, setup_classify),
+}
+
+# Function to run one prepared benchmark in a fresh process so its peak RSS is its own
+def _run_in_child(name, corpus_root, work_dir, corpus, results):
+    _, setup = BENCHMARKS[name]
+    run, input_bytes, items, unit = setup(corpus_root, work_dir, corpus)
+    # The peak so far covers the imports and the inputs the timed call needs in memory
+    setup_rss_mb = peak_rss_mb()
+    metrics.start(name, progress_interval=0)
+    start = time.perf_counter()
+    run()
+    seconds = time.perf_counter() - start
+    results.put({
+        'seconds': seconds,
+        'mb_per_s': input_bytes / (1 << 20) / seconds,
+        f'{unit}_per_s': items / seconds,
+        'setup_rss_mb': setup_rss_mb,
+        'peak_rss_mb': peak_rss_mb(),
+        # Worker processes (e.g. the shard pool) are not part of the benchmark process's own peak
+        'peak_rss_children_mb': peak_rss_mb(children=True),
+        # e.g. the Bloom filter's skipped lookups, to weigh against the time
+        'gauges': dict(metrics.gauges),
+    })
+
+# Function to pick how benchmark processes are started. On Linux a child's peak RSS starts out at its
+# parent's RSS, so where possible children are forked from a server started while the harness is small
+def _process_context():
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')
+
+# Function to wait for a benchmark child's result, returning None if it exits without one or times out
+def _wait_for_result(process, results, timeout):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return results.get(timeout=1)
+        except queue.Empty:
+            pass
+        if not process.is_alive():
+            # The result may have been put just before the child exited
+            try:
+                return results.get(timeout=1)
+            except queue.Empty:
+                return None
+        if time.monotonic() > deadline:
+            process.terminate()
+            return None
+
+def run_benchmark(name, corpus_root, corpus, repeat=1, timeout=3600):
+    prepare, _ = BENCHMARKS[name]
+    context = _process_context()
+    runs = []
+    for _ in range(repeat):
+        work_dir = tempfile.mkdtemp(prefix=f'bench_{name}_')
+        try:
+            # Inputs are written here, so the work of preparing them stays out of the measured process
+            prepare(corpus_root, work_dir, corpus)
+            results = context.Queue()
+            process = context.Process(target=_run_in_child, args=(name, corpus_root, work_dir, corpus, results))
+            process.start()
+            result = _wait_for_result(process, results, timeout)
+            process.join()
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        if result is None or process.exitcode != 0:
+            reason = 'timed out' if process.exitcode == -15 else f'exit code {process.exitcode}'
+            raise RuntimeError(f"Benchmark {name} failed ({reason})")
+        runs.append(result)
+
+    # Keep the fastest run, but the highest memory peaks seen
+    best = min(runs, key=lambda result: result['seconds'])
+    for key in ('setup_rss_mb', 'peak_rss_mb', 'peak_rss_children_mb'):
+        if best[key] is not None:
+            best[key] = max(result[key] for result in runs)
+    return best
+
+# Function to list the benchmarks that got slower, or whose peak RSS grew more, than a previous report allows
+def find_regressions(report, previous, tolerance, memory_tolerance):
+    regressions = []
+    for name, result in report['results'].items():
+        before = previous.get('results', {}).get(name)
+        if not before:
+            continue
+        if result['seconds'] > before['seconds'] * (1 + tolerance):
+            regressions.append(f"{name}: {before['seconds']:.3f}s -> {result['seconds']:.3f}s")
+        for key, label in (('peak_rss_mb', 'peak RSS'), ('peak_rss_children_mb', 'worker peak RSS')):
+            if result.get(key) is None or before.get(key) is None:
+                continue
+            if result[key] > before[key] * (1 + memory_tolerance):
+                regressions.append(f"{name}: {label} {before[key]:.1f} MB -> {result[key]:.1f} MB")
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Time and memory-profile the processing scripts on a synthetic corpus.")
+    parser.add_argument('--corpus', help="existing corpus directory (default: generate one in a temp directory)")
+    parser.add_argument('--size-mb', type=float, default=20, help="size of the generated corpus (default: 20)")
+    parser.add_argument('--vocab-size', type=int, default=50000, help="distinct words in the generated corpus")
+    parser.add_argument('--scripts', default='latin=0.7,cyrillic=0.1,cjk=0.1,arabic=0.05,emoji=0.05',
+                        help="script mix of the generated corpus as name=weight pairs")
+    parser.add_argument('--underscore-density', type=float, default=0.2,
+                        help="share of word separators that are underscores (default: 0.2)")
+    parser.add_argument('--seed', type=int, default=0, help="random seed of the generated corpus (default: 0)")
+    parser.add_argument('--only', action='append', choices=list(BENCHMARKS),
+                        help="benchmark to run (may be repeated; default: all)")
+    parser.add_argument('--repeat', type=int, default=1, help="runs per benchmark, keeping the fastest (default: 1)")
+    parser.add_argument('--output', default='bench_results.json', help="JSON report to write")
+    parser.add_argument('--compare', help="previous JSON report to check for regressions")
+    parser.add_argument('--timeout', type=float, default=3600,
+                        help="seconds a single benchmark run may take before it fails (default: 3600)")
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help="allowed slowdown against --compare before failing (default: 0.1)")
+    parser.add_argument('--memory-tolerance', type=float, default=0.1,
+                        help="allowed peak RSS growth against --compare before failing (default: 0.1)")
+    args = parser.parse_args()
+
+    # Start the fork server before the corpus and the prepared inputs grow the harness process
+    if _process_context().get_start_method() == 'forkserver':
+        from multiprocessing import forkserver
+        forkserver.ensure_running()
+
+    temp_root = None
+    if args.corpus:
+        corpus_root = args.corpus
+        with open(os.path.join(corpus_root, 'corpus.json'), 'r', encoding='utf-8') as f:
+            corpus = json.load(f)
+    else:
+        corpus_root = temp_root = tempfile.mkdtemp(prefix='bench_corpus_')
+        corpus = generate_corpus(corpus_root, args.size_mb, args.vocab_size, parse_script_mix(args.scripts),
+                                 args.underscore_density, seed=args.seed)
+
+    try:
+        report = {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'corpus': corpus,
+            'results': {},
+        }
+        for name in args.only or BENCHMARKS:
+            try:
+                result = run_benchmark(name, corpus_root, corpus, args.repeat, args.timeout)
+            except RuntimeError as e:
+                print(e)
+                sys.exit(1)
+            report['results'][name] = result
+            print(f"{name}: {result['seconds']:.3f}s, {result['mb_per_s']:.2f} MB/s, "
+                  f"peak RSS {result['peak_rss_mb'] or 0:.1f} MB (after setup {result['setup_rss_mb'] or 0:.1f} MB, "
+                  f"workers {result['peak_rss_children_mb'] or 0:.1f} MB)")
+            if 'bloom_checks' in result['gauges']:
+                gauges = result['gauges']
+                print(f"  Bloom filter skipped {gauges['bloom_exact_lookups_skipped']} of "
+                      f"{gauges['bloom_checks']} index lookups, {gauges['bloom_false_positives']} false positives")
+    finally:
+        if temp_root is not None:
+            shutil.rmtree(temp_root, ignore_errors=True)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            regressions = find_regressions(report, json.load(f), args.tolerance, args.memory_tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
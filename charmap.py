@@ -0,0 +1,122 @@
+import os
+import re
+
+# One bit per Unicode code point: 0x110000 bits in 139,264 bytes
+BITMAP_SIZE = 0x110000 // 8
+
+_NONZERO_BYTE = re.compile(rb'[^\x00]')
+
+# Set of characters stored as a code point bitmap
+class CodePointBitmap:
+    def __init__(self, bits=None):
+        if bits is None:
+            bits = bytearray(BITMAP_SIZE)
+        elif len(bits) != BITMAP_SIZE:
+            raise ValueError(f"Code point bitmap must be {BITMAP_SIZE} bytes, got {len(bits)}")
+        self.bits = bytearray(bits)
+
+    @classmethod
+    def from_chars(cls, chars):
+        bitmap = cls()
+        bitmap.update(chars)
+        return bitmap
+
+    @classmethod
+    def load(cls, bitmap_file):
+        with open(bitmap_file, 'rb') as f:
+            return cls(f.read())
+
+    def save(self, bitmap_file):
+        temp_file = bitmap_file + '.tmp'
+        with open(temp_file, 'wb') as f:
+            f.write(self.bits)
+        os.replace(temp_file, bitmap_file)
+
+    def add(self, char):
+        code_point = ord(char)
+        self.bits[code_point >> 3] |= 1 << (code_point & 7)
+
+    def update(self, chars):
+        if isinstance(chars, CodePointBitmap):
+            self |= chars
+            return
+        bits = self.bits
+        for code_point in map(ord, set(chars)):
+            bits[code_point >> 3] |= 1 << (code_point & 7)
+
+    def __contains__(self, char):
+        code_point = ord(char)
+        return bool(self.bits[code_point >> 3] & (1 << (code_point & 7)))
+
+    def _as_int(self):
+        return int.from_bytes(self.bits, 'little')
+
+    def __ior__(self, other):
+        if not isinstance(other, CodePointBitmap):
+            self.update(other)
+            return self
+        self.bits = bytearray((self._as_int() | other._as_int()).to_bytes(BITMAP_SIZE, 'little'))
+        return self
+
+    def __or__(self, other):
+        return CodePointBitmap(self.bits).__ior__(other)
+
+    # Characters in self but not in other, e.g. what a new batch added
+    def __sub__(self, other):
+        return CodePointBitmap((self._as_int() & ~other._as_int()).to_bytes(BITMAP_SIZE, 'little'))
+
+    def __eq__(self, other):
+        return isinstance(other, CodePointBitmap) and self.bits == other.bits
+
+    def __len__(self):
+        return bin(self._as_int()).count('1')
+
+    # Characters in code point order, skipping empty bytes
+    def __iter__(self):
+        bits = self.bits
+        for match in _NONZERO_BYTE.finditer(bits):
+            index = match.start()
+            byte = bits[index]
+            for bit in range(8):
+                if byte >> bit & 1:
+                    yield chr((index << 3) + bit)
+
+    def to_text(self):
+        return ''.join(self)
+
+    # Run-length form: inclusive (start, end) code point ranges
+    def ranges(self):
+        ranges = []
+        for code_point in map(ord, self):
+            if ranges and ranges[-1][1] == code_point - 1:
+                ranges[-1][1] = code_point
+            else:
+                ranges.append([code_point, code_point])
+        return [tuple(code_point_range) for code_point_range in ranges]
+
+# Function to name the bitmap file kept next to a dictionary text file
+def dictionary_bitmap_file(dictionary_file):
+    return os.path.splitext(dictionary_file)[0] + '.bin'
+
+# Function to check whether the bitmap is at least as new as the dictionary text file
+def dictionary_bitmap_is_current(dictionary_file):
+    bitmap_file = dictionary_bitmap_file(dictionary_file)
+    if not os.path.exists(bitmap_file):
+        return False
+    return not os.path.exists(dictionary_file) or os.path.getmtime(bitmap_file) >= os.path.getmtime(dictionary_file)
+
+# Function to read the character dictionary, from the bitmap when it is current
+def load_dictionary(dictionary_file):
+    if dictionary_bitmap_is_current(dictionary_file):
+        return CodePointBitmap.load(dictionary_bitmap_file(dictionary_file))
+    with open(dictionary_file, 'r', encoding='utf-8') as f:
+        return CodePointBitmap.from_chars(f.read().strip())
+
+# Function to write the character dictionary as both the text file and the bitmap
+def save_dictionary(dictionary_file, chars):
+    if not isinstance(chars, CodePointBitmap):
+        chars = CodePointBitmap.from_chars(chars)
+    with open(dictionary_file, 'w', encoding='utf-8') as f:
+        f.write(chars.to_text())
+    # Written last so it is never older than the text file it mirrors
+    chars.save(dictionary_bitmap_file(dictionary_file))
@@ -1,75 +1,436 @@
 import os
+import re
+import json
+import mmap
+import hashlib
+import argparse
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+
+import instrumentation
+from charmap import CodePointBitmap, load_dictionary, save_dictionary
+from instrumentation import metrics
+from io_pool import BackgroundWriter, map_ahead, read_file_bytes, scan_subfolders
 
 # Define the paths
 input_folder = 'chunky/'
 output_folder = 'output_chunks/'
 dictionary_file = 'chara_here.txt'
+manifest_file = 'chunky_manifest.json'
 
-# Ensure the output folder exists
-os.makedirs(output_folder, exist_ok=True)
+# Function to list the input files inside each chunk folder, listing io_threads folders at a time
+def list_input_files(input_folder, io_threads=0):
+    return scan_subfolders(input_folder, io_threads)
 
-# Part 1: Check characters against the dictionary and update it
-def update_dictionary(input_folder, dictionary_file):
-    # Read existing characters from the dictionary
-    with open(dictionary_file, 'r', encoding='utf-8') as f:
-        existing_chars = set(f.read().strip())
-
-    # Iterate through each chunk folder
-    for chunk_folder in os.listdir(input_folder):
-        chunk_path = os.path.join(input_folder, chunk_folder)
-        if os.path.isdir(chunk_path):
-            for filename in os.listdir(chunk_path):
-                file_path = os.path.join(chunk_path, filename)
-                try:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        for line in f:
-                            for char in line.strip():
-                                existing_chars.add(char)  # Add new characters
-                except Exception as e:
-                    print(f"Error reading {file_path}: {e}")
-
-    # Write updated characters back to the dictionary
-    with open(dictionary_file, 'w', encoding='utf-8') as f:
-        f.write(''.join(sorted(existing_chars)))
-
-# Part 2: Extract words and save them in chunks
-def extract_words_and_chunk(input_folder, output_folder):
-    word_count = 0
-    chunk_index = 1
-    chunk_file_path = os.path.join(output_folder, f'chunk_{chunk_index}.txt')
-    
-    # Open the first chunk file for writing
-    chunk_file = open(chunk_file_path, 'w', encoding='utf-8')
-
-    # Iterate through each chunk folder
-    for chunk_folder in os.listdir(input_folder):
-        chunk_path = os.path.join(input_folder, chunk_folder)
-        if os.path.isdir(chunk_path):
-            for filename in os.listdir(chunk_path):
-                file_path = os.path.join(chunk_path, filename)
+# Persistent record of the processed input files and the output chunk position
+class Manifest:
+    def __init__(self, manifest_file):
+        self.manifest_file = manifest_file
+        self.files = {}
+        self.output = None  # [chunk_index, word_count] of the next word to write
+        self._hashes = {}
+
+        if os.path.exists(manifest_file):
+            with open(manifest_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.files = data.get('files', {})
+            self.output = data.get('output')
+
+    # Function to hash a file's content
+    def file_hash(self, file_path):
+        if file_path not in self._hashes:
+            digest = hashlib.sha256()
+            with open(file_path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(block)
+            self._hashes[file_path] = digest.hexdigest()
+        return self._hashes[file_path]
+
+    # Function to check whether a file is new or changed since it was recorded
+    def is_changed(self, file_path):
+        entry = self.files.get(file_path)
+        if entry is None:
+            return True
+
+        try:
+            stat = os.stat(file_path)
+            if entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime_ns:
+                return False
+
+            # Size or mtime moved: only the content hash can tell
+            if entry['size'] != stat.st_size or entry['hash'] != self.file_hash(file_path):
+                return True
+        except OSError:
+            return True  # Gone or unreadable: scanning it again reports the error
+        entry['mtime'] = stat.st_mtime_ns  # Touched but unchanged
+        return False
+
+    # Function to record a processed file and the output range it produced;
+    # content_hash saves reading the file again when the caller already hashed its bytes
+    def record(self, file_path, start, end, content_hash=None):
+        stat = os.stat(file_path)
+        self.files[file_path] = {
+            'size': stat.st_size,
+            'mtime': stat.st_mtime_ns,
+            'hash': content_hash or self.file_hash(file_path),
+            'chunks': {'start': list(start), 'end': list(end)},
+        }
+        self.output = list(end)
+
+    # Function to forget every recorded file, e.g. when the recorded output no longer exists
+    def reset(self):
+        self.files = {}
+        self.output = None
+
+    def save(self):
+        temp_file = self.manifest_file + '.tmp'
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            json.dump({'files': self.files, 'output': self.output}, f, indent=1, sort_keys=True)
+        os.replace(temp_file, self.manifest_file)
+
+# Function to list the input files that still need processing
+def pending_input_files(input_folder, manifest=None, io_threads=0):
+    file_paths = list_input_files(input_folder, io_threads)
+    if manifest is None:
+        return file_paths
+    return [file_path for file_path in file_paths if manifest.is_changed(file_path)]
+
+# Buffered writer for the output chunk files, rolling over every line_limit words.
+# With background=True the files are opened, written and closed on a writer thread.
+class ChunkWriter:
+    def __init__(self, output_folder, line_limit=100000, buffer_size=65536,
+                 chunk_index=1, line_count=0, mode='w', background=False):
+        self.output_folder = output_folder
+        self.line_limit = line_limit
+        self.buffer_size = buffer_size
+        self.chunk_index = chunk_index
+        self.line_count = line_count
+        self.buffer = []
+        self.writer = BackgroundWriter() if background else None
+        self.chunk_file = None
+        self._run(self._open_chunk, self._chunk_path(), mode)
+
+    def _chunk_path(self):
+        return os.path.join(self.output_folder, f'chunk_{self.chunk_index}.txt')
+
+    # Function to run a file operation now, or queue it on the writer thread
+    def _run(self, fn, *args):
+        if self.writer is None:
+            fn(*args)
+        else:
+            self.writer.submit(fn, *args)
+
+    def _open_chunk(self, chunk_path, mode):
+        if self.chunk_file is not None:
+            self.chunk_file.close()
+        self.chunk_file = open(chunk_path, mode, encoding='utf-8')
+
+    def _write_chunk(self, text):
+        self.chunk_file.write(text)
+
+    def _close_chunk(self):
+        self.chunk_file.close()
+
+    # (chunk_index, line_count) the next word will land at, counting buffered words
+    @property
+    def position(self):
+        total = self.line_count + len(self.buffer)
+        return (self.chunk_index + total // self.line_limit, total % self.line_limit)
+
+    def write_words(self, words):
+        self.buffer.extend(words)
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    # Function to write the buffered words, splitting them at the chunk boundaries
+    def flush(self):
+        buffer = self.buffer
+        start = 0
+        while start < len(buffer):
+            end = min(len(buffer), start + self.line_limit - self.line_count)
+            self._run(self._write_chunk, '\n'.join(buffer[start:end]) + '\n')
+            self.line_count += end - start
+            start = end
+            # Check if we need to create a new chunk file
+            if self.line_count >= self.line_limit:
+                self.chunk_index += 1
+                self._run(self._open_chunk, self._chunk_path(), 'w')
+                self.line_count = 0
+                metrics.event('rollover', chunk_file=self._chunk_path())
+        self.buffer = []
+
+    def _sync_chunk(self):
+        self.chunk_file.flush()
+
+    # Function to get every word written so far onto disk, e.g. before recording the position
+    def sync(self):
+        self.flush()
+        self._run(self._sync_chunk)
+        if self.writer is not None:
+            self.writer.wait()
+
+    def close(self):
+        self.flush()
+        self._run(self._close_chunk)
+        if self.writer is not None:
+            self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+# Runs of bytes between ASCII whitespace and underscores; str.split() handles the rest
+_WORD_BYTES = re.compile(rb'[^\s_]+')
+
+# Function to split a file's bytes into words, decoding only the words themselves
+def tokenize_buffer(data):
+    return str(b'\n'.join(_WORD_BYTES.findall(data)), 'utf-8').split()
+
+# Function to find the characters of a file's bytes, as if each line were stripped
+def buffer_characters(data):
+    text = str(data, 'utf-8')
+    if '\r' in text:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    chars = set(text)
+
+    # Whitespace only counts when it appears inside a line, not at either end
+    edge_chars = {char for char in chars if char.isspace()}
+    chars -= edge_chars
+    edge_chars.discard('\n')
+    for line in text.split('\n') if edge_chars else ():
+        found = edge_chars.intersection(line.strip())
+        if found:
+            chars |= found
+            edge_chars -= found
+            if not edge_chars:
+                break
+    return chars
+
+# Function to read a chunk file once, adding its characters to chars and passing its words to emit.
+# data is the file's bytes when they were already prefetched; otherwise the file is memory-mapped.
+# With hash_content=True it returns the SHA-256 of the bytes it read, for the manifest.
+def scan_file(file_path, chars=None, emit=None, data=None, hash_content=False):
+    try:
+        if data is not None:
+            metrics.count('files')
+            metrics.count('bytes', len(data))
+            content_hash = hashlib.sha256(data).hexdigest() if hash_content else None
+            file_chars = buffer_characters(data) if chars is not None else None
+            words = tokenize_buffer(data) if emit is not None else None
+        else:
+            with open(file_path, 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                metrics.count('files')
+                metrics.count('bytes', size)
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
                 try:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        for line in f:
-                            # Replace underscores with spaces and split into words
-                            words = line.strip().replace('_', ' ').split()
-                            for word in words:
-                                chunk_file.write(word + '\n')
-                                word_count += 1
-                                # Check if we need to create a new chunk file
-                                if word_count >= 100000:
-                                    chunk_file.close()
-                                    chunk_index += 1
-                                    chunk_file_path = os.path.join(output_folder, f'chunk_{chunk_index}.txt')
-                                    chunk_file = open(chunk_file_path, 'w', encoding='utf-8')
-                                    word_count = 0
-                except Exception as e:
-                    print(f"Error reading {file_path}: {e}")
-
-    # Close the last chunk file
-    chunk_file.close()
-
-# Run the functions
-update_dictionary(input_folder, dictionary_file)
-extract_words_and_chunk(input_folder, output_folder)
-
-print("Processing complete.")
+                    content_hash = hashlib.sha256(data).hexdigest() if hash_content else None
+                    file_chars = buffer_characters(data) if chars is not None else None
+                    words = tokenize_buffer(data) if emit is not None else None
+                finally:
+                    if size:
+                        data.close()
+    except UnicodeDecodeError:
+        # Invalid UTF-8: go line by line so everything before the bad line is kept
+        with open(file_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if chars is not None:
+                    chars.update(line)
+                if emit is not None:
+                    # Replace underscores with spaces and split into words
+                    words = line.replace('_', ' ').split()
+                    emit(words)
+                    metrics.count('words', len(words))
+        return None
+
+    if chars is not None:
+        chars |= file_chars
+    if emit is not None:
+        emit(words)
+        metrics.count('words', len(words))
+    return content_hash
+
+# Function to read the input files on io_threads threads ahead of the caller, yielding (file_path, data) in order.
+# data is None when the file is read directly instead, or when prefetching it failed.
+def prefetch_input_files(file_paths, io_threads=0):
+    if io_threads <= 0:
+        for file_path in file_paths:
+            yield file_path, None
+        return
+    for file_path, future in map_ahead(file_paths, read_file_bytes, io_threads):
+        # A failed read is retried by scan_file so the error is reported from there
+        yield file_path, future.result() if future.exception() is None else None
+
+# Function to collect the characters of a batch of files (runs in a worker process)
+def collect_characters(file_paths, io_threads=0):
+    chars = CodePointBitmap()
+    for file_path, data in prefetch_input_files(file_paths, io_threads):
+        try:
+            scan_file(file_path, chars=chars, data=data)
+        except Exception as e:
+            metrics.error(file_path, e)
+    return chars
+
+# Function to collect characters in a worker process, returning its metrics along with them.
+# Errors go to the parent's error log as they happen and are recorded under the parent's stage.
+def collect_characters_in_worker(file_paths, io_threads=0, error_log=None, stage=None):
+    metrics.start('worker', progress_interval=0, error_log=error_log)
+    with metrics.stage(stage or 'worker'):
+        chars = collect_characters(file_paths, io_threads)
+    return chars, metrics.snapshot()
+
+# Function to report the characters a run added to the dictionary
+def report_new_characters(existing_chars, updated_chars):
+    added = updated_chars - existing_chars
+    metrics.gauge('dictionary_chars', len(updated_chars))
+    metrics.gauge('new_chars', len(added))
+    print(f"Added {len(added)} new characters to the dictionary.")
+    return added
+
+# Part 1: Check characters against the dictionary and update it
+def update_dictionary(input_folder, dictionary_file, workers=1, manifest=None, io_threads=0):
+    with metrics.stage('update_dictionary'):
+        # Read existing characters from the dictionary
+        existing_chars = load_dictionary(dictionary_file)
+        updated_chars = CodePointBitmap(existing_chars.bits)
+
+        file_paths = pending_input_files(input_folder, manifest, io_threads)
+
+        if workers > 1 and len(file_paths) > 1:
+            # Give each worker an interleaved share of the files and merge their bitmaps
+            shares = [file_paths[i::workers] for i in range(workers)]
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                worker = partial(collect_characters_in_worker, io_threads=io_threads,
+                                 error_log=metrics.error_log, stage='update_dictionary')
+                results = executor.map(worker, [share for share in shares if share])
+                for chars, snapshot in results:
+                    updated_chars |= chars
+                    metrics.merge(snapshot)
+        else:
+            updated_chars |= collect_characters(file_paths, io_threads)
+
+        # Write updated characters back to the dictionary
+        save_dictionary(dictionary_file, updated_chars)
+        return report_new_characters(existing_chars, updated_chars)
+
+# Function to cut the output chunks back to a recorded position, dropping the words an interrupted
+# run wrote after its last manifest save; returns False if the recorded words are not all there
+def restore_chunks(output_folder, chunk_index, line_count):
+    chunk_path = os.path.join(output_folder, f'chunk_{chunk_index}.txt')
+    offset = 0
+    if line_count:
+        if not os.path.exists(chunk_path):
+            return False
+        with open(chunk_path, 'rb') as f:
+            for _ in range(line_count):
+                line = f.readline()
+                if not line.endswith(b'\n'):
+                    return False
+                offset += len(line)
+    if os.path.exists(chunk_path) and os.path.getsize(chunk_path) > offset:
+        with open(chunk_path, 'r+b') as f:
+            f.truncate(offset)
+
+    # Later chunks were started after the last manifest save
+    chunk_index += 1
+    while os.path.exists(os.path.join(output_folder, f'chunk_{chunk_index}.txt')):
+        os.remove(os.path.join(output_folder, f'chunk_{chunk_index}.txt'))
+        chunk_index += 1
+    return True
+
+# Part 2: Extract words and save them in chunks. checkpoint is called before every mid-run manifest save,
+# e.g. to save the characters collected so far, which the files the manifest records have added to chars.
+def extract_words_and_chunk(input_folder, output_folder, manifest=None,
+                            line_limit=100000, buffer_size=65536, chars=None, io_threads=0, checkpoint=None):
+    # Continue after the last recorded word, or start a fresh set of chunks
+    if manifest is not None and manifest.output is not None:
+        chunk_index, line_count = manifest.output
+        mode = 'a'
+        if not restore_chunks(output_folder, chunk_index, line_count):
+            # The recorded output is gone: process everything again into fresh chunks
+            manifest.reset()
+    if manifest is None or manifest.output is None:
+        chunk_index, line_count = 1, 0
+        mode = 'w'
+
+    with metrics.stage('extract_words_and_chunk'), \
+            ChunkWriter(output_folder, line_limit, buffer_size, chunk_index, line_count, mode,
+                        background=io_threads > 0) as writer:
+        # Iterate through each input file, with the next ones being read in the background
+        file_paths = pending_input_files(input_folder, manifest, io_threads)
+        saved_chunk = chunk_index
+        for file_path, data in prefetch_input_files(file_paths, io_threads):
+            start = writer.position
+            try:
+                # Collect the characters too when a set is given, so the file is read only once
+                content_hash = scan_file(file_path, chars=chars, emit=writer.write_words, data=data,
+                                         hash_content=manifest is not None)
+                # Only files that were read in full are recorded; failed ones are tried again next run
+                if manifest is not None:
+                    manifest.record(file_path, start, writer.position, content_hash)
+            except Exception as e:
+                metrics.error(file_path, e)
+
+            if manifest is not None:
+                # Save the manifest at every chunk rollover, once the recorded words are on disk
+                if writer.position[0] != saved_chunk:
+                    writer.sync()
+                    if checkpoint is not None:
+                        checkpoint()
+                    manifest.save()
+                    saved_chunk = writer.position[0]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Update the character dictionary and extract words from chunky/.")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="number of processes used to build the character dictionary (default: 1)")
+    parser.add_argument('--incremental', action='store_true',
+                        help=f"only process new or changed input files recorded in {manifest_file}")
+    parser.add_argument('--io-threads', type=int, default=0,
+                        help="threads used to list and prefetch input files and write output chunks "
+                             "in the background, 0 to do all I/O inline (default: 0)")
+    instrumentation.add_arguments(parser, 'extract_from_chunky')
+    args = parser.parse_args()
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.io_threads < 0:
+        parser.error("--io-threads must not be negative")
+
+    metrics.start('extract_from_chunky', args.progress_interval, args.error_log, verbose=args.verbose)
+
+    # Ensure the output folder exists
+    os.makedirs(output_folder, exist_ok=True)
+
+    if args.incremental:
+        manifest = Manifest(manifest_file)
+    else:
+        # A full run rewrites output_chunks/, so the recorded positions no longer hold
+        manifest = None
+        if os.path.exists(manifest_file):
+            os.remove(manifest_file)
+
+    # Run the functions
+    if args.workers > 1:
+        update_dictionary(input_folder, dictionary_file, workers=args.workers, manifest=manifest,
+                          io_threads=args.io_threads)
+        extract_words_and_chunk(input_folder, output_folder, manifest=manifest, io_threads=args.io_threads)
+    else:
+        # Single pass: collect the characters while extracting the words
+        existing_chars = load_dictionary(dictionary_file)
+        updated_chars = CodePointBitmap(existing_chars.bits)
+        # Files the manifest records are skipped next time, so their characters are saved along with it
+        extract_words_and_chunk(input_folder, output_folder, manifest=manifest, chars=updated_chars,
+                                io_threads=args.io_threads,
+                                checkpoint=lambda: save_dictionary(dictionary_file, updated_chars))
+        save_dictionary(dictionary_file, updated_chars)
+        report_new_characters(existing_chars, updated_chars)
+
+    if manifest is not None:
+        manifest.save()
+
+    if args.metrics:
+        metrics.write_report(args.metrics)
+    print("Processing complete.")
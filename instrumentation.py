@@ -0,0 +1,170 @@
+import sys
+import json
+import time
+from contextlib import contextmanager
+from collections import defaultdict
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+# Function to report the peak resident set size of the current process in MB, or with children=True
+# that of its largest finished child process, e.g. a pool worker
+def peak_rss_mb(children=False):
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return peak / (1 << 20) if sys.platform == 'darwin' else peak / 1024
+
+# Function to find the byte offset of the first invalid UTF-8 sequence in a file
+def decode_error_offset(file_path):
+    try:
+        with open(file_path, 'rb') as f:
+            f.read().decode('utf-8')
+    except UnicodeDecodeError as e:
+        return e.start
+    except OSError:
+        return None
+    return None
+
+# Stage timers, counters, events and errors of one run, with periodic progress lines
+class Metrics:
+    # Silent until a script starts a run, so library use prints nothing
+    def __init__(self):
+        self.start(progress_interval=0)
+
+    # Function to reset the metrics at the start of a run
+    def start(self, name='run', progress_interval=30.0, error_log=None, stream=sys.stderr, verbose=False):
+        self.name = name
+        self.progress_interval = progress_interval
+        self.verbose = verbose
+        self.error_log = error_log
+        self.stream = stream
+        self.started = time.perf_counter()
+        self.last_progress = self.started
+        self.counters = defaultdict(int)
+        self.stages = {}
+        self.stage_stack = []
+        self.gauges = {}
+        self.events = defaultdict(int)
+        self.errors = []
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    # Context manager timing a named stage; counters are also attributed to the innermost stage
+    @contextmanager
+    def stage(self, name):
+        stage = self.stages.setdefault(name, {'seconds': 0.0, 'counters': defaultdict(int)})
+        self.stage_stack.append(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            stage['seconds'] += time.perf_counter() - start
+            self.stage_stack.pop()
+
+    def count(self, name, amount=1):
+        self.counters[name] += amount
+        if self.stage_stack:
+            self.stages[self.stage_stack[-1]]['counters'][name] += amount
+        self.maybe_progress()
+
+    def gauge(self, name, value):
+        self.gauges[name] = value
+
+    # Function to record a notable event such as a chunk file rollover; only a verbose run prints it
+    def event(self, kind, **details):
+        self.events[kind] += 1
+        if self.verbose:
+            self.write_progress(f"{kind}: " + ', '.join(f"{key}={value}" for key, value in details.items()))
+
+    # Function to record a per-file error with its byte offset, printing it as before
+    def error(self, file_path, error, action='reading', offset=None):
+        if offset is None and isinstance(error, UnicodeDecodeError):
+            offset = decode_error_offset(file_path)
+        record = {
+            'time': round(self.elapsed(), 3),
+            'stage': self.stage_stack[-1] if self.stage_stack else None,
+            'path': file_path,
+            'offset': offset,
+            'type': type(error).__name__,
+            'error': str(error),
+        }
+        self.errors.append(record)
+        self.counters['errors'] += 1
+        if self.error_log is not None:
+            with open(self.error_log, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        where = f" at byte {offset}" if offset is not None else ''
+        print(f"Error {action} {file_path}{where}: {error}")
+
+    def write_progress(self, message):
+        print(f"[{self.name} {self.elapsed():8.1f}s] {message}", file=self.stream, flush=True)
+
+    def maybe_progress(self):
+        now = time.perf_counter()
+        if self.progress_interval and now - self.last_progress >= self.progress_interval:
+            self.last_progress = now
+            self.write_progress(self.progress_line())
+
+    def progress_line(self):
+        elapsed = max(self.elapsed(), 1e-9)
+        parts = [f"{name}={value} ({value / elapsed:,.0f}/s)" for name, value in sorted(self.counters.items())]
+        if 'bytes' in self.counters:
+            parts.append(f"{self.counters['bytes'] / elapsed / (1 << 20):.2f} MB/s")
+        parts.extend(f"{kind}={value}" for kind, value in sorted(self.events.items()))
+        return ', '.join(parts) or 'working'
+
+    # Function to export the counters and errors of a worker process
+    def snapshot(self):
+        return {'counters': dict(self.counters), 'errors': list(self.errors), 'events': dict(self.events)}
+
+    # Function to fold a worker snapshot into the current stage
+    def merge(self, snapshot):
+        for name, value in snapshot['counters'].items():
+            self.count(name, value)
+        for kind, value in snapshot['events'].items():
+            self.events[kind] += value
+        self.errors.extend(snapshot['errors'])
+
+    def report(self):
+        elapsed = self.elapsed()
+        stages = {}
+        for name, stage in self.stages.items():
+            seconds = stage['seconds']
+            stages[name] = {
+                'seconds': round(seconds, 3),
+                'counters': dict(stage['counters']),
+                'per_second': {key: value / seconds for key, value in stage['counters'].items()} if seconds else {},
+            }
+        return {
+            'name': self.name,
+            'elapsed_seconds': round(elapsed, 3),
+            'counters': dict(self.counters),
+            'per_second': {key: value / elapsed for key, value in self.counters.items()} if elapsed else {},
+            'stages': stages,
+            'gauges': self.gauges,
+            'events': dict(self.events),
+            'peak_rss_mb': peak_rss_mb(),
+            'peak_rss_children_mb': peak_rss_mb(children=True),
+            'errors': self.errors,
+        }
+
+    def write_report(self, report_file):
+        with open(report_file, 'w', encoding='utf-8') as f:
+            json.dump(self.report(), f, ensure_ascii=False, indent=2)
+
+# Shared metrics of the running script
+metrics = Metrics()
+
+# Function to add the instrumentation options to a script's argument parser
+def add_arguments(parser, name):
+    parser.add_argument('--metrics', metavar='FILE',
+                        help=f"write a JSON metrics report to FILE at the end, e.g. {name}_metrics.json")
+    parser.add_argument('--progress-interval', type=float, default=30.0,
+                        help="seconds between progress lines, 0 to disable (default: 30)")
+    parser.add_argument('--error-log', help="JSON-lines file to append per-file errors to as they happen")
+    parser.add_argument('--verbose', action='store_true', help="also print each event, such as a chunk file rollover")
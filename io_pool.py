@@ -0,0 +1,71 @@
+import os
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# Function to list the entries of a directory with os.scandir, in directory order
+def scan_folder(folder, dirs_only=False):
+    with os.scandir(folder) as entries:
+        return [entry.path for entry in entries if not dirs_only or entry.is_dir()]
+
+# Function to read a whole file as bytes
+def read_file_bytes(file_path):
+    with open(file_path, 'rb') as f:
+        return f.read()
+
+# Function to call fn on item right away, wrapping the outcome in a finished Future
+def _run_now(fn, item):
+    future = Future()
+    try:
+        future.set_result(fn(item))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+# Function to call fn on each item in a thread pool, with at most `threads` calls in flight.
+# Yields (item, future) in input order, so results are consumed deterministically;
+# with threads=0 every call runs inline when its item is reached.
+def map_ahead(items, fn, threads=0):
+    if threads <= 0:
+        for item in items:
+            yield item, _run_now(fn, item)
+        return
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        pending = deque()
+        for item in items:
+            pending.append((item, executor.submit(fn, item)))
+            if len(pending) >= threads:
+                yield pending.popleft()
+        while pending:
+            yield pending.popleft()
+
+# Function to list the files of every subfolder, listing the subfolders concurrently
+def scan_subfolders(folder, threads=0):
+    file_paths = []
+    for _, future in map_ahead(scan_folder(folder, dirs_only=True), scan_folder, threads):
+        file_paths.extend(future.result())
+    return file_paths
+
+# Single background thread running file operations in submission order, so writes overlap
+# with the caller's work; at most max_pending operations are queued before submit blocks
+class BackgroundWriter:
+    def __init__(self, max_pending=8):
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pending = deque()
+        self.max_pending = max_pending
+
+    def submit(self, fn, *args):
+        self.pending.append(self.executor.submit(fn, *args))
+        while len(self.pending) > self.max_pending:
+            self.pending.popleft().result()
+
+    # Function to wait for every queued operation, raising the first error
+    def wait(self):
+        while self.pending:
+            self.pending.popleft().result()
+
+    def close(self):
+        try:
+            self.wait()
+        finally:
+            self.executor.shutdown()
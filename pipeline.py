@@ -0,0 +1,102 @@
+import os
+import argparse
+
+import instrumentation
+from charmap import CodePointBitmap, load_dictionary, save_dictionary
+from instrumentation import metrics
+from extract_from_chunky import (input_folder, output_folder, dictionary_file, manifest_file, list_input_files,
+                                 ChunkWriter, report_new_characters)
+from sort_output_chunks import (all_words_folder, word_index_file, bloom_filter_file,
+                                open_existing_words, close_existing_words, filter_new_words, write_new_words)
+
+# Stage 1: Read the lines of each input file
+def read_lines(file_paths):
+    for file_path in file_paths:
+        try:
+            metrics.count('files')
+            metrics.count('bytes', os.path.getsize(file_path))
+            with open(file_path, 'r', encoding='utf-8') as f:
+                yield from f
+        except Exception as e:
+            metrics.error(file_path, e)
+
+# Stage 2: Add the characters of each line to the character set
+def track_characters(lines, chars):
+    for line in lines:
+        chars.update(line.strip())
+        yield line
+
+# Stage 3: Replace underscores with spaces and split into words
+def tokenize(lines):
+    for line in lines:
+        words = line.strip().replace('_', ' ').split()
+        metrics.count('words', len(words))
+        yield from words
+
+# Optional stage: Copy the words into the output chunk files on their way through
+def tee_to_chunks(words, writer):
+    for word in words:
+        writer.write_words((word,))
+        yield word
+
+# Function to run extraction and deduplication as one streaming pass
+def run_pipeline(input_folder, dictionary_file, all_words_folder, output_folder=None,
+                 index_file=None, bloom_file=None, bloom_fp_rate=0.01):
+    # Read existing characters from the dictionary
+    existing_chars = load_dictionary(dictionary_file)
+    chars = CodePointBitmap(existing_chars.bits)
+
+    existing_words = open_existing_words(all_words_folder, index_file, bloom_file, bloom_fp_rate)
+    writer = ChunkWriter(output_folder) if output_folder is not None else None
+    try:
+        with metrics.stage('pipeline'):
+            words = tokenize(track_characters(read_lines(list_input_files(input_folder)), chars))
+            if writer is not None:
+                words = tee_to_chunks(words, writer)
+            write_new_words(filter_new_words(words, existing_words), all_words_folder)
+    finally:
+        if writer is not None:
+            writer.close()
+    close_existing_words(existing_words, all_words_folder)
+
+    # Write updated characters back to the dictionary
+    save_dictionary(dictionary_file, chars)
+    report_new_characters(existing_chars, chars)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Update the character dictionary and add new words from chunky/ to all_words/ in one pass.")
+    parser.add_argument('--keep-chunks', action='store_true',
+                        help=f"also write the extracted words to {output_folder}")
+    parser.add_argument('--index', action='store_true',
+                        help=f"look words up in the persistent index {word_index_file} instead of loading all_words/")
+    parser.add_argument('--bloom', action='store_true',
+                        help=f"check words against the Bloom filter {bloom_filter_file} before the exact lookup")
+    parser.add_argument('--bloom-fp-rate', type=float, default=0.01,
+                        help="false-positive rate the Bloom filter is sized for (default: 0.01)")
+    instrumentation.add_arguments(parser, 'pipeline')
+    args = parser.parse_args()
+    if not 0 < args.bloom_fp_rate < 1:
+        parser.error("--bloom-fp-rate must be between 0 and 1")
+    if args.bloom and not args.index:
+        parser.error("--bloom requires --index")
+
+    metrics.start('pipeline', args.progress_interval, args.error_log, verbose=args.verbose)
+
+    # Ensure the output folders exist
+    os.makedirs(all_words_folder, exist_ok=True)
+    if args.keep_chunks:
+        os.makedirs(output_folder, exist_ok=True)
+        # Rewriting output_chunks/ invalidates the positions an incremental extract_from_chunky.py run recorded
+        if os.path.exists(manifest_file):
+            os.remove(manifest_file)
+
+    run_pipeline(input_folder, dictionary_file, all_words_folder,
+                 output_folder=output_folder if args.keep_chunks else None,
+                 index_file=word_index_file if args.index else None,
+                 bloom_file=bloom_filter_file if args.bloom else None,
+                 bloom_fp_rate=args.bloom_fp_rate)
+
+    if args.metrics:
+        metrics.write_report(args.metrics)
+    print("Pipeline complete.")
@@ -0,0 +1,71 @@
+import os
+import json
+import argparse
+
+import numpy as np
+
+from ex_chara import SCRIPT_NAMES, script_boundaries
+from extract_from_chunky import input_folder, list_input_files
+
+# Define the output file
+histogram_file = 'script_histogram.json'
+
+# Characters decoded per block when streaming a file
+BLOCK_CHARS = 1 << 22
+
+# Start of every run of code points and its script id, for np.searchsorted
+_boundaries, _script_ids = script_boundaries()
+_BOUNDARIES = np.array(_boundaries, dtype=np.uint32)
+_SCRIPT_IDS = np.array(_script_ids, dtype=np.uint8)
+
+# Function to turn text into an array of code points without a Python loop
+def code_points(text):
+    return np.frombuffer(text.encode('utf-32-le'), dtype='<u4')
+
+# Function to map code points to script ids (indexes into SCRIPT_NAMES)
+def script_ids(code_points):
+    return _SCRIPT_IDS[np.searchsorted(_BOUNDARIES, code_points, side='right') - 1]
+
+# Function to count the characters of each script in a piece of text
+def count_scripts(text):
+    return np.bincount(script_ids(code_points(text)), minlength=len(SCRIPT_NAMES))
+
+# Function to count the characters of each script in a file, one block at a time
+def count_file_scripts(file_path, block_chars=BLOCK_CHARS):
+    counts = np.zeros(len(SCRIPT_NAMES), dtype=np.int64)
+    # newline='' keeps '\r' characters so they are counted like any other
+    with open(file_path, 'r', encoding='utf-8', newline='') as f:
+        for block in iter(lambda: f.read(block_chars), ''):
+            counts += count_scripts(block)
+    return counts
+
+# Function to name the non-zero counts of a script count array
+def histogram(counts):
+    return {SCRIPT_NAMES[script_id]: int(count) for script_id, count in enumerate(counts) if count}
+
+# Function to build per-file and total script histograms over the input folder
+def corpus_histograms(input_folder, block_chars=BLOCK_CHARS):
+    totals = np.zeros(len(SCRIPT_NAMES), dtype=np.int64)
+    files = {}
+    for file_path in list_input_files(input_folder):
+        try:
+            counts = count_file_scripts(file_path, block_chars)
+        except Exception as e:
+            print(f"Error reading {file_path}: {e}")
+            continue
+        totals += counts
+        files[file_path] = histogram(counts)
+    return histogram(totals), files
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Count the characters of each script across chunky/.")
+    parser.add_argument('--block-chars', type=int, default=BLOCK_CHARS,
+                        help=f"characters decoded per block (default: {BLOCK_CHARS})")
+    parser.add_argument('--output', default=histogram_file, help=f"JSON report to write (default: {histogram_file})")
+    args = parser.parse_args()
+
+    totals, files = corpus_histograms(input_folder, args.block_chars)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump({'total': totals, 'files': files}, f, ensure_ascii=False, indent=2)
+
+    print(f"Script histogram written to {os.path.abspath(args.output)}.")
@@ -1,11 +1,24 @@
 import os
+import zlib
+import heapq
+import itertools
+import math
+import mmap
+import struct
+import sqlite3
+import hashlib
+import argparse
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import instrumentation
+from instrumentation import metrics
 
 # Define the paths
 output_folder = 'output_chunks/'
 all_words_folder = 'all_words/'
-
-# Ensure the all_words folder exists
-os.makedirs(all_words_folder, exist_ok=True)
+word_index_file = 'all_words.sqlite3'
+bloom_filter_file = 'all_words.bloom'
 
 # Function to read all words from the all_words folder into a set
 def load_existing_words(all_words_folder):
@@ -18,43 +31,616 @@ def load_existing_words(all_words_folder):
                     existing_words.add(line.strip())
     return existing_words
 
-# Function to add new words to the all_words folder
-def add_new_words(output_folder, all_words_folder):
-    existing_words = load_existing_words(all_words_folder)
-    new_words = []
+# Persistent on-disk membership index over the all_words folder
+class WordIndex:
+    def __init__(self, index_file, all_words_folder):
+        self.all_words_folder = all_words_folder
+        self.conn = sqlite3.connect(index_file)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS words (word TEXT PRIMARY KEY) WITHOUT ROWID')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS files (name TEXT PRIMARY KEY, size INTEGER NOT NULL)')
+        self.sync()
+
+    # Function to list the word files with their current sizes
+    def _file_sizes(self):
+        sizes = {}
+        for filename in os.listdir(self.all_words_folder):
+            file_path = os.path.join(self.all_words_folder, filename)
+            if os.path.isfile(file_path):
+                sizes[filename] = os.path.getsize(file_path)
+        return sizes
+
+    # Function to index whatever was written to the word files since the last sync
+    def sync(self):
+        indexed_sizes = dict(self.conn.execute('SELECT name, size FROM files'))
+        file_sizes = self._file_sizes()
+
+        # A shrunk or deleted file means the folder was rewritten: start over
+        if any(file_sizes.get(name, -1) < size for name, size in indexed_sizes.items()):
+            self.conn.execute('DELETE FROM words')
+            self.conn.execute('DELETE FROM files')
+            indexed_sizes = {}
+
+        for filename, size in file_sizes.items():
+            offset = indexed_sizes.get(filename, 0)
+            if size == offset:
+                continue
+            with open(os.path.join(self.all_words_folder, filename), 'rb') as f:
+                f.seek(offset)
+                self.conn.executemany('INSERT OR IGNORE INTO words VALUES (?)',
+                                      ((line.decode('utf-8').strip(),) for line in f))
+            self.conn.execute('INSERT OR REPLACE INTO files VALUES (?, ?)', (filename, size))
+        self.conn.commit()
+
+    def __contains__(self, word):
+        return self.conn.execute('SELECT 1 FROM words WHERE word = ?', (word,)).fetchone() is not None
+
+    # Function to look up a batch of words with one query, returning the ones in the index
+    def known_words(self, words):
+        words = list(words)
+        query = f"SELECT word FROM words WHERE word IN ({','.join('?' * len(words))})"
+        return {word for (word,) in self.conn.execute(query, words)} if words else set()
+
+    def add(self, word):
+        self.conn.execute('INSERT OR IGNORE INTO words VALUES (?)', (word,))
+
+    def update(self, words):
+        self.conn.executemany('INSERT OR IGNORE INTO words VALUES (?)', ((word,) for word in words))
+
+    # Function to record the current file sizes once the added words are on disk
+    def mark_synced(self):
+        self.conn.executemany('INSERT OR REPLACE INTO files VALUES (?, ?)', self._file_sizes().items())
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+# Function to total the byte size of the word files
+def word_files_size(all_words_folder):
+    total = 0
+    for filename in os.listdir(all_words_folder):
+        file_path = os.path.join(all_words_folder, filename)
+        if os.path.isfile(file_path):
+            total += os.path.getsize(file_path)
+    return total
+
+# Memory-mapped Bloom filter over the words of the all_words folder
+class BloomFilter:
+    MAGIC = b'WORDBLM1'
+    # magic, bit count, hash count, capacity, word count, word files size, false-positive rate
+    HEADER = struct.Struct('<8sQQQQQd')
+
+    def __init__(self, filter_file):
+        self.filter_file = filter_file
+        self.file = open(filter_file, 'r+b')
+        self.mm = mmap.mmap(self.file.fileno(), 0)
+        magic, self.num_bits, self.num_hashes, self.capacity, self.count, self.source_size, self.fp_rate = \
+            self.HEADER.unpack_from(self.mm)
+        if magic != self.MAGIC:
+            self.close()
+            raise ValueError(f"{filter_file} is not a word Bloom filter")
+
+    # Function to create an empty filter sized for a capacity and false-positive rate
+    @classmethod
+    def create(cls, filter_file, capacity, fp_rate):
+        num_bits = max(8, math.ceil(-capacity * math.log(fp_rate) / math.log(2) ** 2))
+        num_hashes = max(1, round(num_bits / capacity * math.log(2)))
+        with open(filter_file, 'wb') as f:
+            f.write(cls.HEADER.pack(cls.MAGIC, num_bits, num_hashes, capacity, 0, 0, fp_rate))
+            f.truncate(cls.HEADER.size + (num_bits + 7) // 8)
+        return cls(filter_file)
+
+    # Each word is hashed once with a 128-bit blake2b digest split into two 64-bit halves h1 and h2;
+    # its bit positions are h1, h1 + h2, h1 + 2 * h2, ... modulo the bit count (double hashing)
+
+    # Function to keep the words of a batch that may be in the filter
+    def maybe_present(self, words):
+        blake2b = hashlib.blake2b
+        from_bytes = int.from_bytes
+        mm = self.mm
+        offset = self.HEADER.size
+        num_bits = self.num_bits
+        probes = range(self.num_hashes)
+        present = []
+        for word in words:
+            h = from_bytes(blake2b(word.encode('utf-8'), digest_size=16).digest(), 'little')
+            step = (h >> 64) | 1
+            h &= 0xFFFFFFFFFFFFFFFF
+            for _ in probes:
+                position = h % num_bits
+                if not mm[offset + (position >> 3)] >> (position & 7) & 1:
+                    break
+                h += step
+            else:
+                present.append(word)
+        return present
+
+    def update(self, words):
+        blake2b = hashlib.blake2b
+        from_bytes = int.from_bytes
+        mm = self.mm
+        offset = self.HEADER.size
+        num_bits = self.num_bits
+        probes = range(self.num_hashes)
+        for word in words:
+            h = from_bytes(blake2b(word.encode('utf-8'), digest_size=16).digest(), 'little')
+            step = (h >> 64) | 1
+            h &= 0xFFFFFFFFFFFFFFFF
+            for _ in probes:
+                position = h % num_bits
+                mm[offset + (position >> 3)] |= 1 << (position & 7)
+                h += step
+            self.count += 1
+
+    def __contains__(self, word):
+        return bool(self.maybe_present((word,)))
+
+    def add(self, word):
+        self.update((word,))
+
+    # Function to record the word files size the filter now covers
+    def mark_synced(self, source_size):
+        self.source_size = source_size
+        self.HEADER.pack_into(self.mm, 0, self.MAGIC, self.num_bits, self.num_hashes,
+                              self.capacity, self.count, self.source_size, self.fp_rate)
+        self.mm.flush()
+
+    def close(self):
+        self.mm.close()
+        self.file.close()
+
+# Function to open the Bloom filter, rebuilding it when it no longer matches all_words
+def load_bloom_filter(filter_file, all_words_folder, fp_rate=0.01):
+    source_size = word_files_size(all_words_folder)
+    if os.path.exists(filter_file):
+        bloom = BloomFilter(filter_file)
+        if bloom.source_size == source_size and bloom.fp_rate == fp_rate and bloom.count <= bloom.capacity:
+            return bloom
+        bloom.close()
+
+    # Size the new filter for twice the current vocabulary to leave room to grow
+    line_count = 0
+    for filename in os.listdir(all_words_folder):
+        file_path = os.path.join(all_words_folder, filename)
+        if os.path.isfile(file_path):
+            with open(file_path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    line_count += block.count(b'\n')
+
+    bloom = BloomFilter.create(filter_file, max(1 << 20, 2 * line_count), fp_rate)
+    for filename in os.listdir(all_words_folder):
+        file_path = os.path.join(all_words_folder, filename)
+        if os.path.isfile(file_path):
+            with open(file_path, 'r', encoding='utf-8') as f:
+                bloom.update(line.strip() for line in f)
+    bloom.mark_synced(source_size)
+    return bloom
+
+# Bloom filter in front of an exact word set, counting the lookups it saves
+class BloomCheckedWords:
+    def __init__(self, bloom, exact_words):
+        self.bloom = bloom
+        self.exact_words = exact_words
+        self.checks = 0
+        self.definitely_new = 0
+        self.false_positives = 0
+
+    def __contains__(self, word):
+        self.checks += 1
+        if word not in self.bloom:
+            self.definitely_new += 1
+            return False
+        if word in self.exact_words:
+            return True
+        self.false_positives += 1
+        return False
+
+    # Function to look up a batch of words, asking the exact store only about those the filter lets through
+    def known_words(self, words):
+        maybe_known = self.bloom.maybe_present(words)
+        self.checks += len(words)
+        self.definitely_new += len(words) - len(maybe_known)
+        known = self.exact_words.known_words(maybe_known)
+        self.false_positives += len(maybe_known) - len(known)
+        return known
+
+    def add(self, word):
+        self.bloom.add(word)
+        self.exact_words.add(word)
+
+    def update(self, words):
+        self.bloom.update(words)
+        self.exact_words.update(words)
+
+    def report(self):
+        saved = self.definitely_new / self.checks if self.checks else 0.0
+        return (f"Bloom filter: {self.checks} checks, {self.definitely_new} exact lookups skipped "
+                f"({saved:.1%}), {self.false_positives} false positives")
+
+# Function to open the set of known words: in memory, or the on-disk index, optionally behind a Bloom filter
+def open_existing_words(all_words_folder, index_file=None, bloom_file=None, bloom_fp_rate=0.01):
+    # A probe costs more than the in-memory set lookup it would save, so the filter only fronts the index
+    if bloom_file is not None and index_file is None:
+        raise ValueError("A Bloom filter requires a word index file")
+    with metrics.stage('load_existing_words'):
+        if index_file is not None:
+            existing_words = WordIndex(index_file, all_words_folder)
+        else:
+            existing_words = load_existing_words(all_words_folder)
+            metrics.gauge('vocabulary_words', len(existing_words))
+        if bloom_file is not None:
+            existing_words = BloomCheckedWords(load_bloom_filter(bloom_file, all_words_folder, bloom_fp_rate),
+                                               existing_words)
+    return existing_words
+
+# Function to close the known words once the new words are on disk
+def close_existing_words(existing_words, all_words_folder):
+    # The index and filter already hold the new words; only the file sizes need recording
+    if isinstance(existing_words, BloomCheckedWords):
+        existing_words.bloom.mark_synced(word_files_size(all_words_folder))
+        existing_words.bloom.close()
+        metrics.gauge('bloom_checks', existing_words.checks)
+        metrics.gauge('bloom_exact_lookups_skipped', existing_words.definitely_new)
+        metrics.gauge('bloom_false_positives', existing_words.false_positives)
+        print(existing_words.report())
+        existing_words = existing_words.exact_words
+    if isinstance(existing_words, WordIndex):
+        existing_words.mark_synced()
+        existing_words.close()
+
+# Function to read the words of the chunk files in the output folder
+def read_chunk_words(output_folder):
+    for filename in sorted(os.listdir(output_folder)):
+        file_path = os.path.join(output_folder, filename)
+        if os.path.isfile(file_path):
+            metrics.count('files')
+            metrics.count('bytes', os.path.getsize(file_path))
+            line_count = 0
+            with open(file_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line_count += 1
+                    yield line.strip()
+            metrics.count('words', line_count)
+
+# Function to keep only the words not seen before
+def filter_new_words(words, existing_words, batch_size=500, seen_limit=1000000):
+    if not hasattr(existing_words, 'known_words'):
+        for word in words:
+            if word and word not in existing_words:
+                existing_words.add(word)  # Add to existing words to avoid duplicates
+                yield word
+        return
+
+    # Stores with a per-lookup cost answer a whole batch of distinct words at once. Words this run
+    # has already looked up or added are remembered, up to seen_limit of them, and not asked again.
+    seen = set()
+    words = iter(words)
+    while True:
+        batch = [word for word in itertools.islice(words, batch_size) if word]
+        if not batch:
+            break
+        unseen = set(batch).difference(seen)
+        known = existing_words.known_words(unseen) if unseen else set()
+        new_words = []
+        for word in batch:
+            if word in unseen and word not in known:
+                known.add(word)  # Also drops later repeats within the batch
+                new_words.append(word)
+        if new_words:
+            existing_words.update(new_words)
+        if len(seen) + len(unseen) > seen_limit:
+            seen.clear()
+        seen |= unseen
+        yield from new_words
+
+# Function to append new words to the all_words files, line_limit words per file
+def write_new_words(new_words, all_words_folder, line_limit=150000, buffer_size=10000):
     current_file_index = 1
     current_file_path = os.path.join(all_words_folder, f'words_{current_file_index}.txt')
-    
+    written = 0
+    batch = []
+
     # Ensure the first file is created
     if not os.path.exists(current_file_path):
         with open(current_file_path, 'w', encoding='utf-8') as f:
             pass  # Create an empty file
 
-    # Iterate through each chunk file in the output folder
-    for filename in sorted(os.listdir(output_folder)):
-        file_path = os.path.join(output_folder, filename)
-        if os.path.isfile(file_path):
-            with open(file_path, 'r', encoding='utf-8') as f:
-                for line in f:
-                    word = line.strip()
-                    if word and word not in existing_words:
-                        new_words.append(word)
-                        existing_words.add(word)  # Add to existing words to avoid duplicates
-                        
-                        # Check if we need to write to a new file
-                        if len(new_words) >= 150000:
-                            with open(current_file_path, 'a', encoding='utf-8') as out_file:
-                                out_file.write('\n'.join(new_words) + '\n')
-                            new_words = []  # Reset the list for the next batch
-                            current_file_index += 1
-                            current_file_path = os.path.join(all_words_folder, f'words_{current_file_index}.txt')
+    for word in new_words:
+        batch.append(word)
+        if len(batch) < buffer_size and written + len(batch) < line_limit:
+            continue
+
+        with open(current_file_path, 'a', encoding='utf-8') as out_file:
+            out_file.write('\n'.join(batch) + '\n')
+        written += len(batch)
+        metrics.count('new_words', len(batch))
+        batch = []  # Reset the list for the next batch
+
+        # Check if we need to write to a new file
+        if written >= line_limit:
+            current_file_index += 1
+            current_file_path = os.path.join(all_words_folder, f'words_{current_file_index}.txt')
+            written = 0
+            metrics.event('rollover', words_file=current_file_path)
 
     # Write any remaining new words to the last file
-    if new_words:
+    if batch:
         with open(current_file_path, 'a', encoding='utf-8') as out_file:
-            out_file.write('\n'.join(new_words) + '\n')
+            out_file.write('\n'.join(batch) + '\n')
+        metrics.count('new_words', len(batch))
+
+# Function to add new words to the all_words folder
+def add_new_words(output_folder, all_words_folder, index_file=None, bloom_file=None, bloom_fp_rate=0.01):
+    existing_words = open_existing_words(all_words_folder, index_file, bloom_file, bloom_fp_rate)
+    with metrics.stage('add_new_words'):
+        words = read_chunk_words(output_folder)
+        write_new_words(filter_new_words(words, existing_words), all_words_folder)
+        close_existing_words(existing_words, all_words_folder)
+
+# Function to pick a word's shard with a hash that is the same in every process
+def word_shard(word, shards):
+    return zlib.crc32(word.encode('utf-8')) % shards
+
+# Function to cut files into (file_path, start, end) pieces of about piece_size bytes, ending on line boundaries
+def split_files(file_paths, piece_size):
+    pieces = []
+    for file_path in file_paths:
+        size = os.path.getsize(file_path)
+        start = 0
+        with open(file_path, 'rb') as f:
+            while start < size:
+                f.seek(start + piece_size)
+                f.readline()  # Move on to the end of the line the cut falls in
+                end = min(f.tell(), size)
+                pieces.append((file_path, start, end))
+                start = end
+    return pieces
+
+# Function to read the stripped lines of a file piece
+def read_piece_lines(piece):
+    file_path, start, end = piece
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    lines = data.decode('utf-8').split('\n')
+    if lines[-1] == '':
+        lines.pop()  # After the final newline
+    return [line.strip() for line in lines]
+
+# Function to split the words of one file piece into per-shard files (runs in a worker process).
+# Incoming words are stored with their position, (piece index << 32) + line number,
+# so the shard results can be merged back into input order.
+def partition_piece(task):
+    kind, piece_index, piece, shards, temp_dir = task
+    crc32 = zlib.crc32  # word_shard, inlined for the hot loop
+    buckets = [[] for _ in range(shards)]
+    lines = read_piece_lines(piece)
+    if kind == 'existing':
+        for word in lines:
+            buckets[crc32(word.encode('utf-8')) % shards].append(word)
+    else:
+        # Only the first occurrence of a word within the piece can be new, so repeats are dropped here
+        base = piece_index << 32
+        seen = {''}
+        for line_number, word in enumerate(lines):
+            if word not in seen:
+                seen.add(word)
+                buckets[crc32(word.encode('utf-8')) % shards].append(f'{base + line_number}\t{word}')
+
+    paths = []
+    for shard, bucket in enumerate(buckets):
+        path = os.path.join(temp_dir, f'{kind}_{piece_index}_{shard}.txt')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(''.join(line + '\n' for line in bucket))
+        paths.append(path)
+    return paths, len(lines)
+
+# Function to read the lines of a per-shard file
+def _read_shard_lines(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        lines = f.read().split('\n')
+    lines.pop()  # After the final newline, or the empty file's only element
+    return lines
+
+# Function to find the new words of one shard (runs in a worker process)
+def dedupe_shard(task):
+    shard, existing_paths, incoming_paths, temp_dir = task
+    existing_words = set()
+    for path in existing_paths:
+        existing_words.update(_read_shard_lines(path))
+
+    # The incoming pieces are read in input order, so the first occurrence of a word is the one kept
+    new_lines = []
+    for path in incoming_paths:
+        for line in _read_shard_lines(path):
+            word = line.partition('\t')[2]
+            if word not in existing_words:
+                existing_words.add(word)
+                new_lines.append(line)
+
+    result_path = os.path.join(temp_dir, f'new_{shard}.txt')
+    with open(result_path, 'w', encoding='utf-8') as f:
+        f.write(''.join(line + '\n' for line in new_lines))
+    return result_path
+
+# Function to read a shard's new words as (position, word) pairs
+def read_shard_result(result_path):
+    with open(result_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            position, _, word = line[:-1].partition('\t')
+            yield int(position), word
+
+# Function to add new words to the all_words folder, deduplicating hash shards in parallel.
+# The input and vocabulary files are cut into pieces that the workers partition into shards
+# themselves; the parent only lists the files and merges the new words back into order.
+def add_new_words_sharded(output_folder, all_words_folder, shards, workers=None, piece_size=None):
+    workers = workers or min(shards, os.cpu_count() or 1)
+    existing_files = [os.path.join(all_words_folder, filename) for filename in os.listdir(all_words_folder)
+                      if os.path.isfile(os.path.join(all_words_folder, filename))]
+    incoming_files = [os.path.join(output_folder, filename) for filename in sorted(os.listdir(output_folder))
+                      if os.path.isfile(os.path.join(output_folder, filename))]
+    incoming_bytes = sum(os.path.getsize(file_path) for file_path in incoming_files)
+    if piece_size is None:
+        # A few pieces per worker keep the pool busy when the pieces take uneven time
+        total_bytes = incoming_bytes + sum(os.path.getsize(file_path) for file_path in existing_files)
+        piece_size = max(1 << 20, total_bytes // (workers * 4))
+
+    with tempfile.TemporaryDirectory(prefix='word_shards_') as temp_dir, \
+            ProcessPoolExecutor(max_workers=workers) as executor:
+        with metrics.stage('partition_words'):
+            existing_pieces = split_files(existing_files, piece_size)
+            incoming_pieces = split_files(incoming_files, piece_size)
+            tasks = [('existing', index, piece, shards, temp_dir) for index, piece in enumerate(existing_pieces)]
+            tasks += [('incoming', index, piece, shards, temp_dir) for index, piece in enumerate(incoming_pieces)]
+            partitioned = list(executor.map(partition_piece, tasks))
+            metrics.count('files', len(incoming_files))
+            metrics.count('bytes', incoming_bytes)
+            metrics.count('words', sum(line_count for _, line_count in partitioned[len(existing_pieces):]))
+
+        with metrics.stage('dedupe_shards'):
+            existing_paths = [paths for paths, _ in partitioned[:len(existing_pieces)]]
+            incoming_paths = [paths for paths, _ in partitioned[len(existing_pieces):]]
+            tasks = [(shard, [paths[shard] for paths in existing_paths], [paths[shard] for paths in incoming_paths],
+                      temp_dir) for shard in range(shards)]
+            result_paths = list(executor.map(dedupe_shard, tasks))
+
+        # Merge the shards back into the order the words were read in
+        with metrics.stage('merge_shards'):
+            merged = heapq.merge(*(read_shard_result(path) for path in result_paths))
+            write_new_words((word for _, word in merged), all_words_folder)
+
+# Rough per-record memory cost on top of the serialized text, for sizing sort runs
+RECORD_OVERHEAD = 120
+
+# Function to write one sorted run to a temporary file
+def _write_run(records, dump, temp_dir):
+    fd, run_path = tempfile.mkstemp(suffix='.run', dir=temp_dir)
+    with open(fd, 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(dump(record) + '\n')
+    return run_path
+
+# Function to stream the records of a run file
+def _read_run(run_path, load):
+    with open(run_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            yield load(line[:-1])
+
+# Function to sort records with bounded memory: sorted runs on disk, then a k-way heap merge
+def external_sort(records, temp_dir, memory_limit, key=None, dump=str, load=str, max_open_runs=64):
+    runs = []
+    batch = []
+    batch_size = 0
+    for record in records:
+        batch.append(record)
+        batch_size += len(dump(record)) + RECORD_OVERHEAD
+        if batch_size >= memory_limit:
+            batch.sort(key=key)
+            runs.append(_write_run(batch, dump, temp_dir))
+            batch = []
+            batch_size = 0
+
+    # Keep the number of open run files bounded by merging the oldest runs first
+    while len(runs) > max_open_runs:
+        merging, runs = runs[:max_open_runs], runs[max_open_runs:]
+        merged = heapq.merge(*(_read_run(run_path, load) for run_path in merging), key=key)
+        runs.append(_write_run(merged, dump, temp_dir))
+        for run_path in merging:
+            os.remove(run_path)
+
+    batch.sort(key=key)
+    yield from heapq.merge(batch, *(_read_run(run_path, load) for run_path in runs), key=key)
+
+# Function to find the first occurrence of each candidate word missing from the vocabulary
+def merge_new_words(sorted_vocabulary, sorted_candidates):
+    vocabulary_word = next(sorted_vocabulary, None)
+    last_word = None
+    for seq, word in sorted_candidates:
+        if word == last_word:
+            continue  # A later occurrence of the same word
+        last_word = word
+        while vocabulary_word is not None and vocabulary_word < word:
+            vocabulary_word = next(sorted_vocabulary, None)
+        if word != vocabulary_word:
+            yield seq, word
+
+def _dump_positioned(record):
+    return f'{record[0]}\t{record[1]}'
+
+def _load_positioned(line):
+    seq, word = line.split('\t', 1)
+    return int(seq), word
+
+# Function to add new words to the all_words folder by sort-merge, within a fixed memory budget
+def add_new_words_external(output_folder, all_words_folder, memory_limit):
+    # Each of the three sorts gets a share of the budget while their merges are open together
+    run_limit = max(1 << 20, memory_limit // 3)
+
+    def existing_words():
+        for filename in os.listdir(all_words_folder):
+            file_path = os.path.join(all_words_folder, filename)
+            if os.path.isfile(file_path):
+                with open(file_path, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        yield line.strip()
+
+    def candidate_words():
+        for seq, word in enumerate(read_chunk_words(output_folder)):
+            if word:
+                yield seq, word
+
+    with metrics.stage('sort_merge'), tempfile.TemporaryDirectory(prefix='word_runs_') as temp_dir:
+        sorted_vocabulary = external_sort(existing_words(), temp_dir, run_limit)
+        sorted_candidates = external_sort(candidate_words(), temp_dir, run_limit,
+                                          key=lambda record: (record[1], record[0]),
+                                          dump=_dump_positioned, load=_load_positioned)
+        new_words = merge_new_words(sorted_vocabulary, sorted_candidates)
+
+        # Put the new words back into the order they were read in
+        ordered = external_sort(new_words, temp_dir, run_limit, key=lambda record: record[0],
+                                dump=_dump_positioned, load=_load_positioned)
+        write_new_words((word for _, word in ordered), all_words_folder)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Add new words from output_chunks/ to all_words/.")
+    parser.add_argument('--index', action='store_true',
+                        help=f"look words up in the persistent index {word_index_file} instead of loading all_words/")
+    parser.add_argument('--bloom', action='store_true',
+                        help=f"check words against the Bloom filter {bloom_filter_file} before the exact lookup")
+    parser.add_argument('--bloom-fp-rate', type=float, default=0.01,
+                        help="false-positive rate the Bloom filter is sized for (default: 0.01)")
+    parser.add_argument('--shards', type=int, default=1,
+                        help="split the words into N hash shards deduplicated by a process pool (default: 1)")
+    parser.add_argument('--memory-limit', type=float, metavar='MB',
+                        help="find new words by external sort-merge using about this much memory")
+    instrumentation.add_arguments(parser, 'sort_output_chunks')
+    args = parser.parse_args()
+    if not 0 < args.bloom_fp_rate < 1:
+        parser.error("--bloom-fp-rate must be between 0 and 1")
+    if args.shards < 1:
+        parser.error("--shards must be at least 1")
+    if args.bloom and not args.index:
+        parser.error("--bloom requires --index")
+    if args.shards > 1 and (args.index or args.bloom):
+        parser.error("--shards cannot be combined with --index or --bloom")
+    if args.memory_limit is not None and (args.shards > 1 or args.index or args.bloom):
+        parser.error("--memory-limit cannot be combined with --shards, --index or --bloom")
+
+    metrics.start('sort_output_chunks', args.progress_interval, args.error_log, verbose=args.verbose)
+
+    # Ensure the all_words folder exists
+    os.makedirs(all_words_folder, exist_ok=True)
 
-# Run the function to add new words
-add_new_words(output_folder, all_words_folder)
+    # Run the function to add new words
+    if args.memory_limit is not None:
+        add_new_words_external(output_folder, all_words_folder, int(args.memory_limit * (1 << 20)))
+    elif args.shards > 1:
+        add_new_words_sharded(output_folder, all_words_folder, args.shards)
+    else:
+        add_new_words(output_folder, all_words_folder,
+                      index_file=word_index_file if args.index else None,
+                      bloom_file=bloom_filter_file if args.bloom else None,
+                      bloom_fp_rate=args.bloom_fp_rate)
 
-print("New words processing complete.")
+    if args.metrics:
+        metrics.write_report(args.metrics)
+    print("New words processing complete.")